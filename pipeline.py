@@ -1,32 +1,67 @@
 from typing import Dict, List, Tuple, Optional, Union
 
-import toml
+# tomllib is in the standard library from python 3.11, tomli provides the same interface for older versions
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
 import json
 import os
-from pathlib import Path
+import re
 
-import argparse
-
-# used to obtain repository and version info - the version is the git commit hash
-import git
+# orjson is used to write the logfiles if it is installed (pip install pipeline[fast-json]), as it is much faster than the standard library json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# used to obtain the version number of an installed library
-from importlib.metadata import version
+import argparse
+import configparser
+import copy
+import logging
 
-# used to parse requirements files
-from dparse import parse, filetypes
+# used to run the items of multistep steps in parallel
+from concurrent.futures import ThreadPoolExecutor
 
-# used to obtain system info on the machine running the pipeline
-import platform
+# git (GitPython), importlib.metadata, dparse and platform are slow to import and only needed by get_repository_info, get_dependencies and get_system_info, so they are imported there
 
         
 import datetime
-import hashlib
-from base64 import urlsafe_b64encode
+import functools
 
 from rich.console import Console
 console = Console()
 
+# used for debugging output, which costs a single level check when debug logging is disabled
+logger = logging.getLogger(__name__)
+
+# bound once, as the current time is taken for every step
+_now = datetime.datetime.now
+
+
+# sidecar file holding the parsed configuration, used to avoid parsing the toml files on every run
+CONFIG_CACHE_FILENAME = '.cache/config.cache.json'
+
+# the names of the dparse file types for each of the dependency file keys in the dependencies.toml file
+DEPENDENCY_FILE_TYPES = {
+    'PIP': 'requirements_txt',
+    'PIPENV': 'pipfile',
+    'CONDA': 'conda_yml'
+}
+
+# matches the package name at the start of a requirements line e.g. `rich[jupyter]>=13.0 ; python_version >= "3.8"` or `requests (>=2.0)`
+# the name has to be followed by extras, a version specifier (optionally parenthesised), an environment marker, a direct reference (@) or the end of the line, which rules out urls such as git+https://
+REQUIREMENT_NAME_PATTERN = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:[<>=!~;@(]|$)')
+
+# requirements lines which are just a path to an archive or wheel, e.g. `foo-1.0-py3-none-any.whl`, don't name a distribution
+REQUIREMENT_ARCHIVE_SUFFIXES = ('.whl', '.tar.gz', '.tgz', '.tar.bz2', '.zip')
+
+# in process cache of parsed configurations, keyed by the absolute path of config.toml
+_config_cache = {}
+
+# in process cache of individual parsed toml files, keyed by absolute path, holding the modification time and the parsed file
+_toml_cache = {}
+
 
 
 
@@ -43,16 +78,15 @@ def create_folder(folder_path:str, verbose:bool) -> str:
         str: the status of the folder e.g. created, already in existence
     """
 
-    # check if the folder exists
-    if not os.path.exists(folder_path):
-        # if it doesn't exist, set folder_status to `folders_created`
+    # try to create the folder and any parent folders needed, rather than checking for it first, this saves a syscall
+    try:
+        os.makedirs(folder_path, exist_ok=False)
+        # if it didn't exist, set folder_status to `folders_created`
         folder_status = 'folders_created'
-        # create the folder and any parent folders needed
-        Path(folder_path).mkdir(parents=True, exist_ok=True)
         # if verbose is set to True, send a message to the terminal
         if verbose:  
             console.print (f"{folder_path} created")  
-    else:
+    except FileExistsError:
         # if it does exist, set folder_status to `folders_in_existence`
         folder_status = 'folders_in_existence'
 
@@ -62,6 +96,61 @@ def create_folder(folder_path:str, verbose:bool) -> str:
     return folder_status
 
 
+def create_folders(folder_paths:List[str], verbose:bool) -> Dict:
+    """
+    This function creates a set of folders in a single pass, creating each folder at most once
+
+    The folders are deduplicated and created shallowest first, so that parent folders exist before their children are created
+
+    Each parent folder is listed once with os.scandir, and only the folders missing from it are created, rather than making a syscall per folder
+
+    Args:
+        folder_paths (List): a list of the full paths to the folders
+        verbose (bool): whether the function should echo to the terminal if this argument is set to True
+
+    Returns:
+        Dict: a dictionary of the folders created and the folders already in existence
+    """
+    folder_statuses = {
+        'folders_created':[],
+        'folders_in_existence':[]
+    }
+    seen = set()
+    # the names in each parent folder, filled in the first time a folder in that parent is needed
+    folder_contents = {}
+    # sorted is stable, so folders at the same depth keep the order they were given in
+    for folder_path in sorted(folder_paths, key=lambda folder_path: os.path.normpath(folder_path).count(os.sep)):
+        normalised_path = os.path.normpath(folder_path)
+        # skip any folder which has already been handled e.g. 'input' and 'input/'
+        if normalised_path in seen:
+            continue
+        seen.add(normalised_path)
+        parent_path, folder_name = os.path.split(normalised_path)
+        if parent_path not in folder_contents:
+            try:
+                with os.scandir(parent_path or '.') as entries:
+                    folder_contents[parent_path] = {entry.name for entry in entries}
+            except FileNotFoundError:
+                folder_contents[parent_path] = set()
+        if folder_name in folder_contents[parent_path]:
+            folder_status = 'folders_in_existence'
+        else:
+            # the folders are reported together below, rather than one message per folder
+            folder_status = create_folder(folder_path, False)
+            folder_contents[parent_path].add(folder_name)
+            # a folder which has just been created is empty, so doesn't need listing
+            if folder_status == 'folders_created':
+                folder_contents[normalised_path] = set()
+        folder_statuses[folder_status].append(folder_path)
+    # if verbose is set to True, send a single summary message to the terminal
+    if verbose:
+        if folder_statuses['folders_created']:
+            console.print (f"Created : {', '.join(folder_statuses['folders_created'])}")
+        if folder_statuses['folders_in_existence']:
+            console.print (f"Already exist : {', '.join(folder_statuses['folders_in_existence'])}")
+    return folder_statuses
+
+
 def get_current_time() -> str:
     """
     This function simply returns the current datetime in isoformat
@@ -69,11 +158,83 @@ def get_current_time() -> str:
     Returns:
         str: the current datetime as an isoformat string
     """
-    return datetime.datetime.now().isoformat()
+    return _now().isoformat()
+
+
+def get_date_hash(date:Union[str, datetime.datetime]) -> str:
+    """
+    This function returns a compact timestamp for a date, used to label the outputs and logs of a run
+
+    Args:
+        date (Union[str, datetime.datetime]): the date, either as a datetime or an isoformat string
+
+    Returns:
+        str: the date in the form YYYYMMDDHHMMSS
+    """
+    if isinstance(date, str):
+        date = datetime.datetime.fromisoformat(date)
+    return date.strftime('%Y%m%d%H%M%S')
+
+
+def normalise_distribution_name(name:str) -> str:
+    """
+    This function normalises a distribution name so that e.g. GitPython, gitpython and Git_Python all match
+
+    Args:
+        name (str): the distribution name
+
+    Returns:
+        str: the normalised distribution name
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+@functools.lru_cache(maxsize=1)
+def get_installed_versions() -> Dict:
+    """
+    This function returns the versions of all the installed distributions
+
+    The installed distributions are scanned once and the result cached for the process, so it is shared by every Pipeline, rather than scanning them again for each dependency
+
+    Returns:
+        Dict: a dictionary of normalised distribution names and their versions
+    """
+    # used to obtain the version number of an installed library
+    from importlib.metadata import distributions
+
+    installed_versions = {}
+    for distribution in distributions():
+        name = distribution.metadata['Name']
+        # distributions with broken metadata can have no name, these are skipped
+        if name:
+            # if a distribution is installed in more than one place, the first one on sys.path wins, as it does for importlib.metadata.version
+            installed_versions.setdefault(normalise_distribution_name(name), distribution.version)
+    return installed_versions
+
+
+def get_requirements_names(requirements_text:str) -> List[str]:
+    """
+    This function returns the names of the packages in a pip requirements file
+
+    Options (e.g. -r, -e, --index-url), comments and bare urls or paths are skipped, as they don't name an installed distribution
 
+    Args:
+        requirements_text (str): the contents of the requirements file
 
-def get_date_hash(isoformat_date:str) -> str:
-    return datetime.datetime.fromisoformat(isoformat_date).strftime('%Y%m%d%H%M%S')
+    Returns:
+        List: a list of the package names, in the order they appear
+    """
+    names = []
+    for line in requirements_text.splitlines():
+        # inline comments must be preceded by whitespace, so a # in a url fragment is left alone
+        line = re.split(r'\s+#', line, maxsplit=1)[0].strip()
+        # only the first token is checked, so a direct reference such as `pkg @ https://host/pkg.whl` is kept
+        if not line or line.split()[0].lower().endswith(REQUIREMENT_ARCHIVE_SUFFIXES):
+            continue
+        match = REQUIREMENT_NAME_PATTERN.match(line)
+        if match:
+            names.append(match.group(1))
+    return names
 
 
 def get_dependencies(filename:str, file_type:str) -> Dict:
@@ -82,6 +243,26 @@ def get_dependencies(filename:str, file_type:str) -> Dict:
     This file is specified in the dependencies.toml config file
     The fun returns a dictionary of the dependencies amd the currently installed versions
 
+    The result is cached, so each dependency file is only read once per process. Each caller gets its own copy, so changing it doesn't affect later logs
+
+    Args:
+        filename (str): the filename for the dependencies file e.g. requirements.txt
+        file_type (str): the type of dependencies file. This is the keyname from the toml file and so is always uppercased to show it's a configuration constant
+    
+    Returns:
+        Dict : the dictionary of dependencies and their version numbers
+    """
+    # the values are version strings (or None), so a shallow copy is enough
+    return dict(_get_dependencies_cached(filename, file_type))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_dependencies_cached(filename:str, file_type:str) -> Dict:
+    """
+    This function reads and resolves a dependency file for get_dependencies, caching the result for the process
+
+    The returned dictionary is shared by every call, so it is only used through get_dependencies, which copies it
+
     Args:
         filename (str): the filename for the dependencies file e.g. requirements.txt
         file_type (str): the type of dependencies file. This is the keyname from the toml file and so is always uppercased to show it's a configuration constant
@@ -91,43 +272,191 @@ def get_dependencies(filename:str, file_type:str) -> Dict:
     """
 
     # the file_type is the key name in the dependencies.toml file
-    if file_type == 'PIP':
-        this_file_type = filetypes.requirements_txt
-    elif file_type == 'PIPENV':
-        this_file_type = filetypes.pipfile
-    elif file_type == 'CONDA':
-        this_file_type = filetypes.conda_yml
-
-    # read the dependencies file
-    with open(filename,'r') as filehandle:
-        dependency_file = parse(filehandle.read(), file_type=this_file_type)
+    this_file_type = DEPENDENCY_FILE_TYPES[file_type]
+
+    # read the dependencies file, in binary and decoded once to skip newline translation
+    with open(filename,'rb') as filehandle:
+        dependency_text = filehandle.read().decode('utf-8')
     
     # create an array of the dependency names
-    dependencies = [dependency['name'] for dependency in json.loads(dependency_file.json())['dependencies']]
-    # create an array of the versions
-    versions = [version(dependency) for dependency in dependencies]
+    if file_type == 'PIP':
+        # only the names are needed from a requirements file, which doesn't need the full dparse parser
+        dependencies = get_requirements_names(dependency_text)
+    else:
+        # used to parse Pipfiles and conda environment files
+        from dparse import parse, filetypes
+        dependency_file = parse(dependency_text, file_type=getattr(filetypes, this_file_type))
+        dependencies = [dependency.name for dependency in dependency_file.dependencies]
+    # create an array of the versions, looked up from a single scan of the installed distributions
+    installed_versions = get_installed_versions()
+    versions = [installed_versions.get(normalise_distribution_name(dependency)) for dependency in dependencies]
     # return a dictionary of the dependencies and versions
     return {k:v for k,v in zip(dependencies,versions)}
 
 
+def find_git_folder(path:str) -> str:
+    """
+    This function walks up from a path to find the .git folder of the repository containing it
+
+    For worktrees and submodules .git is a file of the form `gitdir: <path>` pointing at the real git folder, which is followed
+
+    Args:
+        path (str): the path to start from, usually the current working directory
+
+    Returns:
+        str: the path to the .git folder
+    """
+    path = os.path.abspath(path)
+    while True:
+        git_folder = os.path.join(path, '.git')
+        if os.path.isdir(git_folder):
+            return git_folder
+        if os.path.isfile(git_folder):
+            with open(git_folder, 'r') as filehandle:
+                gitdir = filehandle.read().strip()
+            if not gitdir.startswith('gitdir: '):
+                raise ValueError(f"Unable to parse {git_folder}")
+            # the gitdir path may be relative to the folder containing the .git file
+            return os.path.normpath(os.path.join(path, gitdir[len('gitdir: '):]))
+        parent_path = os.path.dirname(path)
+        if parent_path == path:
+            raise FileNotFoundError(f"No git repository found above {path}")
+        path = parent_path
+
+
+def get_git_common_folder(git_folder:str) -> str:
+    """
+    This function returns the folder holding the shared refs and config for a git folder
+
+    For a worktree this is the main repository's .git folder, given in the commondir file, otherwise it is the git folder itself
+
+    Args:
+        git_folder (str): the path to the .git folder
+
+    Returns:
+        str: the path to the common git folder
+    """
+    try:
+        with open(os.path.join(git_folder, 'commondir'), 'r') as filehandle:
+            return os.path.normpath(os.path.join(git_folder, filehandle.read().strip()))
+    except FileNotFoundError:
+        return git_folder
+
+
+def read_git_head(git_folder:str) -> str:
+    """
+    This function reads the commit sha of HEAD directly from the files in the .git folder
+
+    Args:
+        git_folder (str): the path to the .git folder
+
+    Returns:
+        str: the commit sha of HEAD
+    """
+    with open(os.path.join(git_folder, 'HEAD'), 'r') as filehandle:
+        head = filehandle.read().strip()
+    # a detached HEAD contains the sha itself, otherwise it contains the ref of the current branch
+    if not head.startswith('ref: '):
+        return head
+    ref = head[len('ref: '):]
+    # HEAD is per worktree, but branch refs are shared with the main repository
+    common_folder = get_git_common_folder(git_folder)
+    try:
+        with open(os.path.join(common_folder, ref), 'r') as filehandle:
+            return filehandle.read().strip()
+    except FileNotFoundError:
+        # refs which have been packed (e.g. after git gc) are only in packed-refs, in lines of the form `sha ref`
+        with open(os.path.join(common_folder, 'packed-refs'), 'r') as filehandle:
+            for line in filehandle:
+                if line.startswith(('#', '^')):
+                    continue
+                sha, _, packed_ref = line.strip().partition(' ')
+                if packed_ref == ref:
+                    return sha
+    raise ValueError(f"Unable to resolve {ref} in {git_folder}")
+
+
+def read_git_remote_url(git_folder:str, remote:str='origin') -> str:
+    """
+    This function reads the url of a remote directly from the config file in the .git folder
+
+    Args:
+        git_folder (str): the path to the .git folder
+        remote (str): the name of the remote e.g. origin
+
+    Returns:
+        str: the url of the remote
+    """
+    git_config = configparser.ConfigParser(strict=False, interpolation=None, allow_no_value=True)
+    # the config is shared by all of the worktrees of a repository
+    git_config.read(os.path.join(get_git_common_folder(git_folder), 'config'))
+    return git_config[f'remote "{remote}"']['url']
+
+
+@functools.lru_cache(maxsize=1)
+def _get_repo():
+    """
+    This function opens the current git repository with GitPython, only opening it once per process
+
+    Any other function which needs the GitPython repository should use this rather than opening it again
+
+    Returns:
+        git.Repo: the GitPython repository object
+    """
+    # used to obtain repository and version info - the version is the git commit hash
+    import git
+    return git.Repo(search_parent_directories=True)
+
+
+@functools.lru_cache(maxsize=1)
 def get_repository_info() -> Union[str,str,str]:
     """
     This function retrieves information about the current git repository
+
+    If the PIPELINE_REPOSITORY_NAME or PIPELINE_VERSION (or GIT_COMMIT) environment variables are set, e.g. in CI, their values are used instead. If both are set the git repository is not opened
+
+    Any value not set in the environment is read directly from the files in the .git folder, falling back to GitPython if they can't be parsed
+
+    The result is cached, so the repository is only read once per process
+
+    Returns:
+        str: the repository name
+        str: the pipeline version, the commit sha of the current HEAD
+        str: the pipeline name, a human readable form of the repository name
     """
-    repo = git.Repo(search_parent_directories=True)
-    repository_name = repo.remotes.origin.url.split('.git')[0].split('/')[-1]
-    pipeline_version = repo.head.object.hexsha
+    repository_name = os.environ.get('PIPELINE_REPOSITORY_NAME')
+    pipeline_version = os.environ.get('PIPELINE_VERSION') or os.environ.get('GIT_COMMIT')
+    # only the values missing from the environment are read from git
+    if not repository_name or not pipeline_version:
+        try:
+            git_folder = find_git_folder(os.getcwd())
+            if not repository_name:
+                repository_name = read_git_remote_url(git_folder).split('.git')[0].split('/')[-1]
+            if not pipeline_version:
+                pipeline_version = read_git_head(git_folder)
+        except (OSError, ValueError, KeyError, configparser.Error):
+            repo = _get_repo()
+            if not repository_name:
+                repository_name = repo.remotes.origin.url.split('.git')[0].split('/')[-1]
+            if not pipeline_version:
+                pipeline_version = repo.head.object.hexsha
     pipeline_name = repository_name.replace('_',' ').capitalize()
     return repository_name, pipeline_version, pipeline_name
 
 
+@functools.lru_cache(maxsize=1)
 def get_system_info() -> Union[Dict, None]:
     """
     This function returns information on the computer hardware running this particular instance of the pipeline
 
+    The information doesn't change while the process is running, so it is cached after the first call
+
     Returns:
         Dict: a dictionary of information on the system
     """
+    # used to obtain system info on the machine running the pipeline
+    import platform
+
     try:
         info={}
         info['platform']=platform.system()
@@ -141,6 +470,144 @@ def get_system_info() -> Union[Dict, None]:
     return info
 
 
+def get_file_fingerprint(filenames:List[str]) -> Dict:
+    """
+    This function builds a fingerprint of a set of files from their modification time and size
+
+    Args:
+        filenames (List): a list of the filenames to fingerprint
+
+    Returns:
+        Dict: a dictionary of filenames and their [st_mtime_ns, st_size] values
+    """
+    fingerprint = {}
+    for filename in filenames:
+        stat = os.stat(filename)
+        # stored as a list rather than a tuple so that it compares equal after a round trip through json
+        fingerprint[filename] = [stat.st_mtime_ns, stat.st_size]
+    return fingerprint
+
+
+def _load_toml_cached(filename:str) -> Dict:
+    """
+    This function parses a toml file, only parsing it again within the process if its modification time has changed
+
+    This means that when one module configuration file changes, only that file is parsed again
+
+    Args:
+        filename (str): the filename of the toml file
+
+    Returns:
+        Dict: the parsed toml file
+    """
+    cache_key = os.path.abspath(filename)
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _toml_cache.get(cache_key)
+    if cached is not None and cached[0] == mtime:
+        parsed_toml = cached[1]
+    else:
+        with open(filename, 'rb') as filehandle:
+            parsed_toml = tomllib.load(filehandle)
+        # replacing the entry for the path means an edited file doesn't leave its old parse in memory
+        _toml_cache[cache_key] = (mtime, parsed_toml)
+    # each caller gets its own copy, so changing it can't alter the cached parse
+    return copy.deepcopy(parsed_toml)
+
+
+def parse_config_files(config_filename:str) -> Tuple[Dict, List[str]]:
+    """
+    This function parses the top level configuration file and each of the module configuration files it references
+
+    Args:
+        config_filename (str): the filename of the top level configuration file e.g. config.toml
+
+    Returns:
+        Dict: a dictionary of configuration variables, keyed by module
+        List: a list of all the toml files which were read
+    """
+    config = {}
+    files = _load_toml_cached(config_filename)
+    filenames = [config_filename]
+
+    for file in files['MODULES']:
+        this_config = _load_toml_cached(f"{files[file]}")
+        # _load_toml_cached returns a fresh copy, so it can be used directly
+        config[file] = this_config
+        filenames.append(f"{files[file]}")
+    return config, filenames
+
+
+def _load_config_cached(config_filename:str='config.toml', cache_filename:str=CONFIG_CACHE_FILENAME) -> Tuple[Dict, Dict]:
+    """
+    This function returns the parsed configuration, reading it from the json cache file if none of the toml files have changed since it was written
+
+    If any of the toml files have changed (or the cache is missing or unreadable), the toml files are parsed and the cache is rewritten
+
+    Args:
+        config_filename (str): the filename of the top level configuration file e.g. config.toml
+        cache_filename (str): the filename of the json cache file
+
+    Returns:
+        Dict: a dictionary of configuration variables
+        Dict: the fingerprint of the toml files the configuration was read from
+    """
+    try:
+        with open(cache_filename, 'r') as cachefile:
+            cache = json.load(cachefile)
+        # the cache is only valid for the configuration file it was built from
+        # the fingerprint includes config.toml, so a change to the list of modules will also invalidate the cache
+        if cache['config_filename'] == os.path.abspath(config_filename) and get_file_fingerprint(list(cache['fingerprint'].keys())) == cache['fingerprint']:
+            return cache['config'], cache['fingerprint']
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        # a missing, unreadable or stale cache just means the configuration is parsed again
+        pass
+
+    config, filenames = parse_config_files(config_filename)
+    cache = {
+        'config_filename': os.path.abspath(config_filename),
+        'fingerprint': get_file_fingerprint(filenames),
+        'config': config
+    }
+    try:
+        # serialise before opening the file so that a configuration json can't represent (e.g. toml dates) doesn't leave a partial cache
+        cache_json = json.dumps(cache)
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        with open(cache_filename, 'w') as cachefile:
+            cachefile.write(cache_json)
+    except (OSError, TypeError, ValueError):
+        # failing to write the cache shouldn't stop the pipeline from running
+        pass
+    return config, cache['fingerprint']
+
+
+def _load_config_once(config_filename:str='config.toml') -> Dict:
+    """
+    This function returns the parsed configuration, only loading it once per process unless one of the toml files has changed
+
+    Each caller gets its own copy of the cached configuration, so changes made by one Pipeline (or step) don't affect any other
+
+    Args:
+        config_filename (str): the filename of the top level configuration file e.g. config.toml
+
+    Returns:
+        Dict: a dictionary of configuration variables
+    """
+    # keyed by absolute path so that a change of working directory doesn't return the wrong configuration
+    cache_key = os.path.abspath(config_filename)
+    if cache_key in _config_cache:
+        fingerprint, config = _config_cache[cache_key]
+        try:
+            if get_file_fingerprint(list(fingerprint.keys())) == fingerprint:
+                return copy.deepcopy(config)
+        except OSError:
+            pass
+    config, fingerprint = _load_config_cached(config_filename)
+    # store the fingerprint with absolute paths, the module filenames in config.toml are relative to the working directory
+    fingerprint = {os.path.abspath(filename):value for filename, value in fingerprint.items()}
+    _config_cache[cache_key] = (fingerprint, config)
+    return copy.deepcopy(config)
+
+
 class Pipeline():
     """
     This class provides methods and internal variable storage to allow the processing of datasets
@@ -149,7 +616,10 @@ class Pipeline():
         """
         This function loads some initial setup data from configuration and from command line arguments and initialises the pipeline
         """
-        self.console = Console()
+        # reuse the module level console rather than probing the terminal again for a second one
+        self.console = console
+        # when the output isn't a terminal (e.g. CI, cron), the spinner and rich rendering are skipped on the hot path
+        self.interactive = self.console.is_terminal
         self.config = self.load_config()
         self.kwargs = self.parse_cli_args()
         self.verbose = self.kwargs['verbose']
@@ -164,18 +634,13 @@ class Pipeline():
         """ 
         This function loads the configuration file for the pipline, traverses the contained configuration files and returns a dictionary of values
 
+        The parsed configuration is cached on disk, so the toml files are only parsed again when one of them has changed
+
         Returns:
             Dict: a dictionary of configuration variables 
 
         """
-        config = {}
-        files = toml.load('config.toml')
-
-        for file in files['MODULES']:
-            this_config = toml.load(f"{files[file]}")
-            config[file] = {}
-            for k,v in this_config.items():
-                config[file][k] = v
+        config = _load_config_once()
         #self.console.print("Configuration")
         #self.console.print (config)
         return config
@@ -188,19 +653,20 @@ class Pipeline():
         Returns:
             Dict: a dictionary of command line arguments and variables
         """
-        arguments = [value for key, value in self.config['ARGPARSE']['ARGUMENTS'].items()]
+        argparse_config = self.config['ARGPARSE']
+        arguments = argparse_config['ARGUMENTS'].values()
 
-        parser = argparse.ArgumentParser(prog=self.config['ARGPARSE']['PROG'],
-                    description=self.config['ARGPARSE']['DESCRIPTION'],
-                    epilog=self.config['ARGPARSE']['EPILOG'])    
+        parser = argparse.ArgumentParser(prog=argparse_config['PROG'],
+                    description=argparse_config['DESCRIPTION'],
+                    epilog=argparse_config['EPILOG'])    
 
         for argument in arguments:
             parser.add_argument(f"-{argument['FLAG']}", 
                 f"--{argument['VARIABLE_NAME']}", 
                 help=argument['HELP'], 
-                action=argument['ACTION'])
+                action=argument['ACTION'],
+                default=argument['DEFAULT'])
 
-        parser.set_defaults(**{argument['VARIABLE_NAME']:argument['DEFAULT'] for argument in arguments})
         kwargs = vars(parser.parse_args())
         return kwargs
 
@@ -212,8 +678,10 @@ class Pipeline():
         It is also responsible for setting output folders
         #TODO think about whether some of these steps would be better suited to be split out to individual functions called from __init__()
         """
-        started_at = get_current_time()
-        self.datehash = get_date_hash(started_at)
+        # the start time is kept as a datetime as well as a string, so it doesn't need parsing again to calculate the execution time
+        self.started_at = _now()
+        started_at = self.started_at.isoformat()
+        self.datehash = get_date_hash(self.started_at)
 
         self.repository_name, self.pipeline_version, self.pipeline_name = get_repository_info()
 
@@ -245,7 +713,7 @@ class Pipeline():
         substep_number = None
         step_title_number = self.get_step_title_number(step_number, substep_number)
         action_output = self.create_base_folder_structure()
-        action_log = self.build_action_log(step_number, substep_number, started_at, None, action_output, action_name='create_base_folder_structure')
+        action_log = self.build_action_log(step_number, substep_number, self.started_at, None, action_output, action_name='create_base_folder_structure')
         self.action_logs['steps'][step_title_number] = action_log
     
 
@@ -253,13 +721,19 @@ class Pipeline():
         """
         This function iterates through the individual sets of dependencies in the configuration and returns a dictionary of them
 
+        The dependency files are read in parallel in a thread pool, as each is independent and mostly file I/O
+
         Returns:
             Dict: a dictionary of the dependencies
         """
-        dependencies = {}
-        for dependency_type in self.config['DEPENDENCIES']:
-            dependencies[dependency_type.lower()] = get_dependencies(self.config['DEPENDENCIES'][dependency_type], dependency_type)
-        return dependencies
+        dependency_files = self.config['DEPENDENCIES']
+        if not dependency_files:
+            return {}
+        # scan the installed distributions once up front, rather than in each thread
+        get_installed_versions()
+        with ThreadPoolExecutor(max_workers=min(8, len(dependency_files))) as executor:
+            futures = {dependency_type:executor.submit(get_dependencies, dependency_files[dependency_type], dependency_type) for dependency_type in dependency_files}
+        return {dependency_type.lower():future.result() for dependency_type, future in futures.items()}
 
 
     def finalise(self) -> Dict:
@@ -270,27 +744,69 @@ class Pipeline():
             Dict: the action_logs log dictionary
         """
         self.action_logs['dependencies'] = self.bundle_dependency_list()
-        self.action_logs['completed_at'] = get_current_time()
-        start = datetime.datetime.fromisoformat(self.action_logs['started_at'])
-        end = datetime.datetime.fromisoformat(self.action_logs['completed_at'])
-        delta = end - start
+        completed_at = _now()
+        self.action_logs['completed_at'] = completed_at.isoformat()
+        delta = completed_at - self.started_at
+        # the step times are stored as datetimes while the pipeline runs, and only formatted once here before the log is written
+        for action_log in self.action_logs['steps'].values():
+            for time_key in ['started_at', 'completed_at']:
+                if isinstance(action_log[time_key], datetime.datetime):
+                    action_log[time_key] = action_log[time_key].isoformat()
         logfilename = f"{self.log_path}/{self.repository_name}-{self.datehash}.json"
-        with open(logfilename, 'w') as logfile:
-            logfile.write(json.dumps(self.action_logs, sort_keys=True, indent=4))
+        # the log is written to a temporary file and then moved into place, so a failed write never leaves a partial logfile
+        temp_logfilename = f"{logfilename}.tmp"
+        try:
+            log_bytes = None
+            if orjson:
+                # both paths write sorted keys, an indent of 2 (the only indent orjson supports) and unescaped utf-8, and convert non string keys
+                # they still differ for NaN and infinity, which orjson writes as null and json as NaN and Infinity
+                try:
+                    log_bytes = orjson.dumps(self.action_logs, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+                except orjson.JSONEncodeError:
+                    # orjson can't encode some values json can, e.g. integers beyond 64 bits, so these logs are written by json
+                    log_bytes = None
+            if log_bytes is not None:
+                with open(temp_logfilename, 'wb') as logfile:
+                    logfile.write(log_bytes)
+            else:
+                # json.dump writes to the file as it encodes, rather than building the whole log as one string first
+                with open(temp_logfilename, 'w', encoding='utf-8') as logfile:
+                    json.dump(self.action_logs, logfile, sort_keys=True, indent=2, ensure_ascii=False)
+            os.replace(temp_logfilename, logfilename)
+        except Exception:
+            # don't leave a partially written temporary file behind
+            if os.path.exists(temp_logfilename):
+                os.remove(temp_logfilename)
+            raise
         self.console.print(f"Pipeline completed at {self.action_logs['completed_at']} : Execution time : {delta}") 
         return self.action_logs
 
 
+    def echo(self, *objects):
+        """
+        This function prints progress output, using rich when running in a terminal and a plain print otherwise
+
+        Args:
+            *objects: the objects to print
+        """
+        if self.interactive:
+            self.console.print(*objects)
+        else:
+            print(*objects)
+
+
     def load_steps(self, steps:Dict):
         """
         This function takes the steps dictionary as input which contains information about individual steps including the function name to perform
+
+        The step numbers are normalised to strings once here, so they don't need converting on every lookup
         """
-        self.steps = steps
+        self.steps = {str(step_number):step for step_number, step in steps.items()}
         self.console.rule(title=f"Running {self.pipeline_name}")
         self.console.print ("")
         self.console.print(f"There are {len(self.steps)} steps to this pipeline")
-        for step_number in self.steps:
-            self.console.print(f"{step_number}. {self.steps[step_number]['title_verb'][1]} {self.steps[step_number]['title_template']}")
+        for step_number, step in self.steps.items():
+            self.console.print(f"{step_number}. {step['title_verb'][1]} {step['title_template']}")
         self.console.print("")
         pass
 
@@ -302,17 +818,17 @@ class Pipeline():
         Returns:
             Dict: a dictionary of keyword arguments
         """
-        return {k:v for k,v in self.kwargs.items()}
+        return self.kwargs.copy()
 
 
-    def build_action_log(self, step_number:int, substep_number:Union[int, None], started_at:str, additional_args:Union[Dict,None], action_output:Dict, action_name:str=None) -> Dict:
+    def build_action_log(self, step_number:int, substep_number:Union[int, None], started_at:Union[str, datetime.datetime], additional_args:Union[Dict,None], action_output:Dict, action_name:str=None) -> Dict:
         """
         This function builds an action log to a consistent structure from some inputs and outputs
 
         Args:
             step_number (int): the step number e.g. 1
             substep_number (int): the substep number, None if not a multipart step
-            started_at (str): an isoformatted string for the datetime of when the step was started
+            started_at (Union[str, datetime.datetime]): the datetime of when the step was started, formatted as an isoformat string when the log is written
             additional_args (Dict): a dictionary of additional arguments for multipart steps
             action_output (Dict): the output of a step
 
@@ -320,24 +836,28 @@ class Pipeline():
             Dict: the structured action log
         """
         if not action_name:
-            action_name = self.steps[step_number]['function'].__name__
+            action_name = self.steps[str(step_number)]['function'].__name__
         return {
             'step': step_number,
             'substep_number': substep_number,
             'step_action': action_name,
             'started_at':started_at,
-            'completed_at': get_current_time(),
+            'completed_at': _now(),
             'arguments': additional_args,
             'action_output': action_output
         }
 
 
-    def get_step_title_number(self, step_number:int, substep_number:Union[int, None]) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_step_title_number(step_number:int, substep_number:Union[int, None]) -> str:
         """
         This structure generates a step title number. If there is no substep number it just returns a string of the step_number
 
         Otherwise it returns a number of the form step_number.substep_number
 
+        The title numbers only depend on the step and substep numbers, so they are cached
+
         Args:
             step_number (int): the step number e.g. 1
             substep_number (int): the substep number, None if not a multipart step
@@ -347,11 +867,7 @@ class Pipeline():
         Returns:
             str : step_title_number, the title number for the step, also used as the key for the step in the combined log
         """
-        if substep_number:
-            step_title_number = f"{step_number}.{substep_number}"
-        else:
-            step_title_number = str(step_number)
-        return step_title_number
+        return f"{step_number}.{substep_number}" if substep_number else str(step_number)
 
 
     def run(self, step_number, substep_number, additional_args, **kwargs) -> Tuple[str,Dict]:
@@ -367,19 +883,24 @@ class Pipeline():
             Dict: the action_output of the step
         """
 
-        started_at = get_current_time()
+        started_at = _now()
         step_title_number = self.get_step_title_number(step_number, substep_number)
-        self.console.rule(title=f"{step_title_number}. {self.steps[step_number]['title_verb'][0]} {self.steps[step_number]['title_template'].format(**kwargs)}")
+        step = self.steps[str(step_number)]
+        self.console.rule(title=f"{step_title_number}. {step['title_verb'][0]} {step['title_template'].format(**kwargs)}")
         
-        step_function = self.steps[str(step_number)]['function']
+        step_function = step['function']
             
-        if not self.steps[str(step_number)]['has_progress']:
-            with console.status(f"Running step {step_title_number}..."):
+        # the spinner repaints from a separate thread, which is wasted work without a terminal to show it on
+        if not step['has_progress'] and self.interactive:
+            with self.console.status(f"Running step {step_title_number}..."):
                 action_output = step_function(**kwargs)
         else:
             action_output = step_function(**kwargs)
-        console.print(f"Step {step_title_number} completed.\nOutput:")
-        console.print (action_output)
+        self.echo(f"Step {step_title_number} completed.")
+        # rendering the full output is expensive for large outputs, so it is only shown in verbose mode
+        if self.verbose:
+            self.echo("Output:")
+            self.echo(action_output)
         return step_title_number, self.build_action_log(step_number, substep_number, started_at, additional_args, action_output)
 
 
@@ -389,30 +910,42 @@ class Pipeline():
 
         In the case of multi part steps, where the function is repeated with different parameters, these additional parameters come from the muli_param and multi_options parameters in the step
 
+        If a multi part step sets max_workers, the items are run in parallel in a thread pool of that size, otherwise they are run sequentially
+
         An example of this is processing different loci
 
         Returns:
             List: a list of the outputs of the step
         """
         # TODO refactor to bring in some of the complexity from the allele pipeline implementation of Pipeline
+        step = self.steps[str(step_number)]
         kwargs = self.get_kwargs()
         kwargs['config'] = self.config 
         kwargs['output_path'] = self.output_path
         kwargs['console'] = self.console
         kwargs['datehash'] = self.datehash
-        kwargs['function_name'] = self.steps[str(step_number)]['function'].__name__
-        kwargs['has_progress'] = self.steps[str(step_number)]['has_progress']
+        kwargs['function_name'] = step['function'].__name__
+        kwargs['has_progress'] = step['has_progress']
 
         action_log_items = []
-        if self.steps[str(step_number)]['is_multi']:
+        if step['is_multi']:
             # TODO multistep action logging, refactor all of this when you have a real multistep function to work with
-            print ('MULTISTEP')
-            print (f"multistep parameter : {self.steps[str(step_number)]['multi_param']}")
-            print (f"multistep options : {self.steps[str(step_number)]['multi_options']}")
-            for item in self.steps[str(step_number)]['multi_options']:
-                kwargs[self.steps[str(step_number)]['multi_param']] = item
-                action_log = self.steps[str(step_number)]['function'](**kwargs)
-                action_log_items.append(action_log)
+            logger.debug('MULTISTEP')
+            # the values are passed as arguments so they are only formatted if debug logging is enabled
+            logger.debug("multistep parameter : %s", step['multi_param'])
+            logger.debug("multistep options : %s", step['multi_options'])
+            multi_param = step['multi_param']
+            step_function = step['function']
+            if step.get('max_workers'):
+                # steps which set max_workers are independent per item and are run in a thread pool, each item gets its own copy of the kwargs
+                # executor.map returns the outputs in the order of the multi_options
+                with ThreadPoolExecutor(max_workers=step['max_workers']) as executor:
+                    action_log_items = list(executor.map(lambda item: step_function(**{**kwargs, multi_param: item}), step['multi_options']))
+            else:
+                # the kwargs are built once, only the multi_param value changes between items
+                for item in step['multi_options']:
+                    kwargs[multi_param] = item
+                    action_log_items.append(step_function(**kwargs))
         else:
             substep_number = None
             additional_args = None
@@ -442,7 +975,5 @@ class Pipeline():
 
         folders = ['input','output','tmp','log']
         self.console.print ('Creating base folder structure')
-        for folder in folders:
-            folder_status = create_folder(folder, self.verbose)
-            action_log[folder_status].append(folder)
+        action_log.update(create_folders(folders, self.verbose))
         return action_log